@@ -1,10 +1,101 @@
 import heapq
 import argparse
+import errno
+import os
+import sys
+from operator import itemgetter
+
+# First line of every log written by this version; files without it are read as version 1
+FORMAT_VERSION = 1
+_HEADER = b"# heapqbasic %d\n" % FORMAT_VERSION
+
+
+def _write_all(fd, data):
+    """
+    Write all of data to a file descriptor.
+    """
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _read_all(fd, size, offset=0):
+    """
+    Read size bytes of a file descriptor, starting at offset.
+    """
+    chunks = []
+    end = offset + size
+    while offset < end:
+        if hasattr(os, 'pread'):
+            chunk = os.pread(fd, end - offset, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            chunk = os.read(fd, end - offset)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        offset += len(chunk)
+    return b"".join(chunks)
+
+
+def _copy_range(src_fd, dst_fd, offset, count):
+    """
+    Copy count bytes at offset of src_fd to the current position of dst_fd.
+
+    On Linux this uses sendfile() so the data never leaves the kernel; elsewhere
+    sendfile() may not accept a file as the destination, so it is read and written,
+    as it is when the filesystem does not support sendfile().
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            while count:
+                sent = os.sendfile(dst_fd, src_fd, offset, count)
+                if not sent:
+                    raise EOFError("The queue file was truncated during compaction")
+                offset += sent
+                count -= sent
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    while count:
+        data = os.read(src_fd, min(count, 1 << 20))
+        if not data:
+            raise EOFError("The queue file was truncated during compaction")
+        _write_all(dst_fd, data)
+        count -= len(data)
+
 
 class PersistentPriorityQueue:
     """
     A persistent priority queue implemented using a text file for storage.
+
+    The file starts with a "# heapqbasic <version>" line followed by an append-only
+    log of records:
+    - "+ <priority> <item>" pushes an item (its id is the index of the record among the pushes),
+    - "- <id>" removes the item with that id (tombstone),
+    - "= <id> <priority>" changes the priority of the item with that id.
+    Plain "<priority> <item>" lines from older files are read as pushes.
+    Popping the item pushed by the last record removes that record instead.
+    Records are UTF-8 encoded and end with a single "\\n" on every platform.
+
+    Items are kept in an in-memory binary heap (heapq) which is loaded lazily
+    from the file on first use, and reloaded only if the file's mtime or size
+    changes while no changes are pending. New records are buffered and appended by
+    flush() / close() or once the buffer is full, and the file is compacted once
+    more than half of its records are dead (between flushes, once there are at
+    least compact_min_dead of them). sync() also forces them to disk. Pending
+    changes are only written if no other writer changed the file in the meantime;
+    otherwise they are dropped with a RuntimeError. A queue which is garbage
+    collected without close() is closed then; reading never creates the file.
     """
+    # Pending records are appended to the file once they reach this many bytes
+    write_buffer_size = 1 << 20
+    # Between flushes, the log is only compacted once it has this many dead records
+    compact_min_dead = 1024
+
     def __init__(self, file_path):
         """
         Initialize the persistent priority queue.
@@ -13,6 +104,493 @@ class PersistentPriorityQueue:
         - file_path (str): The path to the text file used for storage.
         """
         self.file_path = file_path
+        # Heap of (priority, id, item) tuples; the id keeps ties in file order.
+        # Entries which are not the current self._live entry of their id are stale
+        # and skipped lazily.
+        # (A radix heap is not an option: pushes and priority changes may go below
+        # the last popped priority, and priorities may be negative.)
+        self._items = None
+        # Live items as {id: (priority, id, item)}, always iterating in ascending id order.
+        # The values are the very tuples in the heap, so validity is an identity check.
+        self._live = None
+        # Ids whose "+" record cannot be copied as is by compact() (their priority
+        # changed since, or the record is a legacy line or lacks its newline), or None
+        # once the ids were renumbered
+        self._changed = set()
+        # (offset, lengths, gaps) of the records read by the last load or written by the
+        # last compaction: the offset of the first record, the length of every record
+        # without its newline, and the indexes of the records which are not pushes.
+        # compact() finds the "+" records to copy from it without reading the file.
+        self._layout = None
+        # (id, start) when the last record of the log pushed the item with that id;
+        # start is its offset in the file, or None while the record is still pending.
+        # Popping that item then removes the record instead of adding a tombstone.
+        self._tail = None
+        # Ids of the live items by item, as {item: {id: None, ...}}; the inner dicts act
+        # as ordered sets so that an id can be removed without a scan. Only
+        # change_priority() needs it, so it is built there on first use.
+        self._index = None
+        self._seq = 0
+        # Number of records in the log (written and pending)
+        self._records = 0
+        # Encoded records not yet appended to the file, and their total size
+        self._log = []
+        self._log_size = 0
+        # Descriptor kept open for the queue's lifetime (reads, appends and rewrites)
+        self._fd = None
+        self._rewrite = False
+        # reorder_priorities() is applied lazily; pops in the meantime take priorities 1, 2, ...
+        self._reorder_pending = False
+        self._reorder_popped = 0
+        # Whether the file is empty, so the next append has to start with the header
+        self._needs_header = False
+        # (st_ino, st_mtime_ns, st_size) of the file as last read or written by this queue
+        self._signature = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # A queue which is dropped without close() still writes its changes; the
+        # check skips instances whose __init__ did not complete
+        if hasattr(self, '_signature'):
+            self.close()
+
+    def _load(self):
+        """
+        Replay the log from the file into the in-memory heap, reusing the
+        parsed items for as long as the file is unchanged.
+
+        Returns:
+        - list: The heap of (priority, id, item) tuples.
+        """
+        if self._items is None and self._log:
+            # Records pushed before the queue was loaded
+            self._write_log()
+
+        if self._items is not None:
+            # Reuse the parsed items unless another writer changed the file;
+            # with pending changes the in-memory queue is kept as is
+            if self._log or self._rewrite or self._reorder_pending or self._stat() == self._signature:
+                return self._items
+
+            # The file may have been replaced, so reopen it by path
+            self._close_fd()
+
+        data = self._read_file()
+        self._signature = self._stat()
+        live = {}
+        changed = set()
+        seq = 0
+        records = 0
+        tail = None
+        offset = 0
+        lines = []
+        gaps = set()
+
+        if data:
+            # Split the whole file in a single C call, leaving the interpreter
+            # loop with just the per-record parsing
+            lines = data.split(b'\n')
+            if not lines[-1]:
+                lines.pop()
+
+            if lines and lines[0].startswith(b'#'):
+                self._check_header(lines[0])
+                offset = len(lines[0]) + 1
+                del lines[0]
+            records = len(lines)
+
+            for line in lines:
+                # partition() returns a tuple of slices without building a list
+                op, _, rest = line.strip().partition(b' ')
+                if op == b'+':
+                    priority, _, item = rest.partition(b' ')
+                    live[seq] = (int(priority), seq, item.decode())
+                    seq += 1
+                elif op == b'-':
+                    # Tolerate records about removed items, which concurrent
+                    # writers may have left behind
+                    live.pop(int(rest), None)
+                    gaps.add(seq + len(gaps))
+                elif op == b'=':
+                    item_id, _, priority = rest.partition(b' ')
+                    item_id = int(item_id)
+                    entry = live.get(item_id)
+                    if entry is not None:
+                        live[item_id] = (int(priority), item_id, entry[2])
+                        changed.add(item_id)
+                    gaps.add(seq + len(gaps))
+                else:
+                    # Plain "<priority> <item>" line
+                    live[seq] = (int(op), seq, rest.decode())
+                    changed.add(seq)
+                    seq += 1
+
+            # Only the last line can be a push record to truncate on pop
+            if lines and lines[-1].strip().partition(b' ')[0] not in (b'-', b'='):
+                tail = (seq - 1, len(data) - len(lines[-1]) - data.endswith(b'\n'))
+                if not data.endswith(b'\n'):
+                    changed.add(seq - 1)
+
+        items = list(live.values())
+        heapq.heapify(items)
+        self._items = items
+        self._live = live
+        self._changed = changed
+        # Lines are short, so the lengths are mostly cached small ints
+        self._layout = (offset, list(map(len, lines)), gaps)
+        self._tail = tail
+        self._needs_header = not data
+        self._index = None
+        self._seq = seq
+        self._records = records
+        return items
+
+    def _check_header(self, line):
+        """
+        Make sure the file was written in a format this version can read.
+
+        Parameters:
+        - line (bytes): The first line of the file.
+        """
+        fields = line.split()
+        if len(fields) != 3 or fields[:2] != [b'#', b'heapqbasic'] or not fields[2].isdigit():
+            raise ValueError(f"'{self.file_path}' is not a queue file.")
+        if int(fields[2]) > FORMAT_VERSION:
+            raise ValueError(f"'{self.file_path}' uses queue file format {int(fields[2])}, "
+                             f"only up to {FORMAT_VERSION} is supported.")
+
+    def _stat(self):
+        """
+        Get the signature used to detect changes to the file.
+
+        Returns:
+        - tuple: (st_ino, st_mtime_ns, st_size) of the file, or None if it does not exist.
+        """
+        try:
+            st = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _check_unchanged(self):
+        """
+        Make sure no other writer changed the file since this queue last read or
+        wrote it, as the pending records refer to the ids as they were then.
+
+        On a conflict the pending changes are dropped, so that the queue is
+        reloaded from the file on next use.
+        """
+        if self._items is None or self._stat() == self._signature:
+            return
+
+        self._items = None
+        self._live = None
+        self._log = []
+        self._log_size = 0
+        self._rewrite = False
+        self._reorder_pending = False
+        self._tail = None
+        self._close_fd()
+        raise RuntimeError(f"'{self.file_path}' was changed by another writer, "
+                           f"the pending changes were dropped.")
+
+    def _open(self, create=True):
+        """
+        Get the descriptor of the file, opening (or creating) it on first use.
+
+        Parameters:
+        - create (bool): Whether to create a missing file; reads pass False so that
+          they never leave an empty file behind.
+
+        Returns:
+        - int: The file descriptor, opened for reading and appending, or None if the
+          file does not exist and create is False.
+        """
+        if self._fd is None:
+            flags = os.O_RDWR | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+            try:
+                self._fd = os.open(self.file_path, flags | (os.O_CREAT if create else 0), 0o644)
+            except FileNotFoundError:
+                if create:
+                    raise
+        return self._fd
+
+    def _close_fd(self):
+        """
+        Close the descriptor of the file, if it is open.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_file(self):
+        """
+        Read the whole file with a single pread().
+
+        Returns:
+        - bytes: The contents of the file.
+        """
+        fd = self._open(create=False)
+        if fd is None:
+            return b""
+        size = os.fstat(fd).st_size
+
+        # The log is always read front to back, so ask for aggressive read-ahead
+        if size and hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return _read_all(fd, size)
+
+    def _find_spans(self):
+        """
+        Find the "+" records in the file which can be copied as is by compact(),
+        i.e. those of live items whose priority is unchanged since.
+
+        Returns:
+        - dict: The byte range of each such record, as {id: (start, end)}.
+        """
+        live = self._live
+        changed = self._changed
+        spans = {}
+        if changed is None:
+            return spans
+
+        # Records appended since the layout was taken are encoded again
+        offset, lengths, gaps = self._layout
+        item_id = 0
+        for index, length in enumerate(lengths):
+            start = offset
+            offset += length + 1
+            if index in gaps:
+                continue
+            if item_id in live and item_id not in changed:
+                spans[item_id] = (start, offset)
+            item_id += 1
+        return spans
+
+    def _build_index(self):
+        """
+        Rebuild the item to ids index from the live items.
+        """
+        index = {}
+        for _, item_id, item in self._live.values():
+            index.setdefault(item, {})[item_id] = None
+        self._index = index
+
+    def _append(self, *records, pushed=None):
+        """
+        Add records to the pending log.
+
+        Parameters:
+        - records (bytes): The encoded records.
+        - pushed (int): The id of the item pushed by the last record, if it is a push.
+        """
+        self._tail = None if pushed is None else (pushed, None)
+        self._log.extend(records)
+        self._records += len(records)
+        self._log_size += sum(map(len, records))
+
+        # Appending is safe mid-operation as it keeps the ids; a pending rewrite
+        # (or a compaction) has to wait for the end of the operation, see _maybe_compact()
+        if self._log_size >= self.write_buffer_size and not self._rewrite:
+            self._write_log()
+
+    def _write_log(self):
+        """
+        Append the pending records to the file with a single write.
+        """
+        self._check_unchanged()
+
+        # With O_APPEND every write goes to the end of the file
+        fd = self._open()
+        data = b"".join(self._log)
+        size = os.fstat(fd).st_size
+        if self._items is None:
+            # Pushes made without loading the queue; the file was never read, so its
+            # header has to be checked before anything is added to it
+            if size == 0:
+                data = _HEADER + data
+            else:
+                first = _read_all(fd, min(size, 64)).partition(b'\n')[0]
+                if first.startswith(b'#'):
+                    try:
+                        self._check_header(first)
+                    except ValueError:
+                        # The records can never be written, so do not keep them
+                        self._log = []
+                        self._log_size = 0
+                        raise
+        elif self._needs_header:
+            data = _HEADER + data
+            self._needs_header = False
+        # End a last line which lacks its newline, or the first record would run into it
+        if size and _read_all(fd, 1, size - 1) != b'\n':
+            data = b'\n' + data
+        _write_all(fd, data)
+        if self._tail is not None:
+            self._tail = (self._tail[0], os.fstat(fd).st_size - len(self._log[-1]))
+        self._log = []
+        self._log_size = 0
+        self._signature = self._stat()
+
+    def _top(self):
+        """
+        Drop stale entries from the top of the heap.
+
+        Returns:
+        - tuple: The (priority, id, item) entry with the highest priority.
+        """
+        items = self._load()
+        live = self._live
+        while items:
+            entry = items[0]
+            if live.get(entry[1]) is entry:
+                return entry
+            heapq.heappop(items)
+
+        raise IndexError("Queue is empty")
+
+    def compact(self):
+        """
+        Rewrite the file with only the live items, dropping tombstones and
+        superseded priority changes.
+        """
+        self._load()
+        self._check_unchanged()
+        self._apply_reorder()
+        live = list(self._live.values())
+
+        # Write the live items to a temporary file in id order, then rename it over
+        # the log. Runs of "+" records which are unchanged since they were read are
+        # copied from the old file as is, the rest is encoded again.
+        src_fd = self._open(create=False)
+        spans = self._find_spans()
+        tmp_path = self.file_path + '.tmp'
+        dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            _write_all(dst_fd, _HEADER)
+            new_live = {}
+            lengths = []
+            offset = len(_HEADER)
+            start = None
+            run = None
+            pending = []
+            for item_id, (priority, old_id, item) in enumerate(live):
+                span = spans.get(old_id)
+                if span is not None:
+                    if pending:
+                        _write_all(dst_fd, b"".join(pending))
+                        pending = []
+                    if run is not None and run[1] == span[0]:
+                        run[1] = span[1]
+                    else:
+                        if run is not None:
+                            _copy_range(src_fd, dst_fd, run[0], run[1] - run[0])
+                        run = [span[0], span[1]]
+                    size = span[1] - span[0]
+                else:
+                    if run is not None:
+                        _copy_range(src_fd, dst_fd, run[0], run[1] - run[0])
+                        run = None
+                    record = b"+ %d %s\n" % (priority, item.encode())
+                    pending.append(record)
+                    size = len(record)
+
+                # The ids are renumbered to match the rewritten file
+                new_live[item_id] = (priority, item_id, item)
+                lengths.append(size - 1)
+                start = offset
+                offset += size
+
+            if run is not None:
+                _copy_range(src_fd, dst_fd, run[0], run[1] - run[0])
+            if pending:
+                _write_all(dst_fd, b"".join(pending))
+
+            # The rewritten file is only read again on the next load, so keep it
+            # from evicting other pages. Dirty pages cannot be dropped, hence the sync.
+            if hasattr(os, 'posix_fadvise'):
+                os.fdatasync(dst_fd)
+                os.posix_fadvise(dst_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except BaseException:
+            os.close(dst_fd)
+            os.remove(tmp_path)
+            raise
+
+        os.close(dst_fd)
+        self._close_fd()
+        os.replace(tmp_path, self.file_path)
+
+        self._live = new_live
+        self._changed = set()
+        self._layout = (len(_HEADER), lengths, set())
+        self._needs_header = False
+        self._tail = None
+        if live:
+            self._tail = (len(live) - 1, start)
+        self._index = None
+        self._items = list(new_live.values())
+        heapq.heapify(self._items)
+        self._seq = len(live)
+        self._records = len(live)
+        self._log = []
+        self._log_size = 0
+        self._rewrite = False
+        self._signature = self._stat()
+
+    def _maybe_compact(self):
+        """
+        Compact the log (which also drops the stale heap entries) once more than half
+        of its records are dead, or once the buffer is full while the file has to be
+        rewritten anyway. Called at the end of every change, where the ids are stable.
+        """
+        dead = self._records - len(self._live)
+        if dead > len(self._live) and dead >= self.compact_min_dead:
+            self.compact()
+        elif self._rewrite and self._log_size >= self.write_buffer_size:
+            self.compact()
+
+    def flush(self):
+        """
+        Append the pending records to the file, compacting it instead if more
+        than half of its records are dead.
+        """
+        if not self._log and not self._rewrite and not self._reorder_pending:
+            return
+
+        if self._items is None:
+            # Only pushes made without loading the queue are pending
+            self._write_log()
+            return
+
+        self._apply_reorder()
+        if self._rewrite or self._records > 2 * len(self._live):
+            self.compact()
+            return
+
+        self._write_log()
+
+    def sync(self):
+        """
+        Flush any pending changes and make sure they reach the disk.
+        """
+        self.flush()
+        fd = self._open(create=False)
+        if fd is not None:
+            getattr(os, 'fdatasync', os.fsync)(fd)
+
+    def close(self):
+        """
+        Flush any pending changes to the file and release it.
+        """
+        try:
+            self.flush()
+        finally:
+            self._close_fd()
 
     def push(self, item, priority):
         """
@@ -22,8 +600,31 @@ class PersistentPriorityQueue:
         - item: The item to push into the queue.
         - priority: The priority associated with the item.
         """
-        with open(self.file_path, 'a') as file:
-            file.write(f"{priority} {item}\n")
+        # Keep what is written, as reading the file back gives string items and int
+        # priorities (a priority which is not an integer fails here, before anything changes)
+        item = str(item)
+        priority = int(priority)
+        record = b"+ %d %s\n" % (priority, item.encode())
+        if self._items is None:
+            # Nothing is loaded yet, so there is no id to track and the record is just
+            # buffered; _load() writes it out before replaying the log
+            self._log.append(record)
+            self._log_size += len(record)
+            if self._log_size >= self.write_buffer_size:
+                self._write_log()
+            return
+
+        self._apply_reorder()
+        items = self._load()
+        item_id = self._seq
+        self._seq += 1
+        entry = (priority, item_id, item)
+        self._live[item_id] = entry
+        if self._index is not None:
+            self._index.setdefault(item, {})[item_id] = None
+        heapq.heappush(items, entry)
+        self._append(record, pushed=item_id)
+        self._maybe_compact()
 
     def pop(self):
         """
@@ -32,26 +633,46 @@ class PersistentPriorityQueue:
         Returns:
         - item: The item with the highest priority.
         """
-        # Read all items from the file and store them in a list of (priority, item) tuples
-        items = []
-        with open(self.file_path, 'r') as file:
-            for line in file:
-                priority, item = line.strip().split(' ', 1)
-                items.append((int(priority), item))
-
-        if not items:
-            raise IndexError("Queue is empty")
-
-        # Find the item with the highest priority
-        highest_priority_item = min(items, key=lambda x: x[0])
-
-        # Remove the item from the list and update the file
-        items.remove(highest_priority_item)
-        with open(self.file_path, 'w') as file:
-            for priority, item in items:
-                file.write(f"{priority} {item}\n")
-
-        return highest_priority_item[1]
+        _, item_id, item = self._top()
+        heapq.heappop(self._items)
+        del self._live[item_id]
+        if self._reorder_pending:
+            self._reorder_popped += 1
+        if self._index is not None:
+            item_ids = self._index[item]
+            del item_ids[item_id]
+            if not item_ids:
+                del self._index[item]
+
+        # The offset of a written tail record is only valid while the file is unchanged
+        tail = self._tail
+        if tail is not None and tail[0] == item_id and (tail[1] is None or self._stat() == self._signature):
+            self._drop_tail()
+        else:
+            self._append(b"- %d\n" % item_id)
+        self._maybe_compact()
+        return item
+
+    def _drop_tail(self):
+        """
+        Remove the push record at the end of the log, from the pending records or by
+        truncating the file, so that popping its item needs no tombstone.
+        """
+        start = self._tail[1]
+        if start is None:
+            self._log_size -= len(self._log.pop())
+        else:
+            os.ftruncate(self._open(), start)
+            self._signature = self._stat()
+            _, lengths, gaps = self._layout
+            if self._tail[0] + len(gaps) == len(lengths) - 1:
+                # The record was the last one loaded, the next push takes its place
+                lengths.pop()
+
+        # Ids count the push records, so the next push reuses this one
+        self._records -= 1
+        self._seq -= 1
+        self._tail = None
 
     def peek(self):
         """
@@ -60,17 +681,7 @@ class PersistentPriorityQueue:
         Returns:
         - item: The item with the highest priority.
         """
-        items = []
-        with open(self.file_path, 'r') as file:
-            for line in file:
-                priority, item = line.strip().split(' ', 1)
-                items.append((int(priority), item))
-
-        if not items:
-            raise IndexError("Queue is empty")
-
-        highest_priority_item = min(items, key=lambda x: x[0])
-        return highest_priority_item[1]
+        return self._top()[2]
 
     def is_empty(self):
         """
@@ -79,8 +690,16 @@ class PersistentPriorityQueue:
         Returns:
         - bool: True if the queue is empty, False otherwise.
         """
-        with open(self.file_path, 'r') as file:
-            return not any(True for line in file)
+        if self._items is None and not self._log:
+            # An empty (or missing) file needs no read at all
+            try:
+                if os.stat(self.file_path).st_size == 0:
+                    return True
+            except FileNotFoundError:
+                return True
+
+        self._load()
+        return not self._live
 
     def change_priority(self, target_item, new_priority):
         """
@@ -90,65 +709,83 @@ class PersistentPriorityQueue:
         - target_item: The item whose priority you want to change.
         - new_priority: The new priority to assign to the item.
         """
-        items = []
-        updated_items = []
-
-        # Read all items from the file and store them in a list of (priority, item) tuples
-        with open(self.file_path, 'r') as file:
-            for line in file:
-                priority, item = line.strip().split(' ', 1)
-                items.append((int(priority), item))
-
-        # Find the target item and update its priority
-        found = False
-        for priority, item in items:
-            if item == target_item:
-                updated_items.append((new_priority, item))
-                found = True
-            else:
-                updated_items.append((priority, item))
-
-        if not found:
+        new_priority = int(new_priority)
+        self._apply_reorder()
+        items = self._load()
+
+        if self._index is None:
+            self._build_index()
+        item_ids = self._index.get(target_item)
+        if not item_ids:
             raise ValueError(f"Item '{target_item}' not found in the queue.")
 
-        # Write the updated items back to the file
-        with open(self.file_path, 'w') as file:
-            for priority, item in updated_items:
-                file.write(f"{priority} {item}\n")
+        # Update the priority of every copy of the item; the old heap entries go stale
+        for item_id in item_ids:
+            entry = (new_priority, item_id, target_item)
+            self._live[item_id] = entry
+            if self._changed is not None:
+                self._changed.add(item_id)
+            heapq.heappush(items, entry)
+            self._append(b"= %d %d\n" % (item_id, new_priority))
+        self._maybe_compact()
 
     def reorder_priorities(self):
         """
         Reorder the priorities in the queue to be consecutive starting from 1.
+
+        The renumbering itself is deferred until a priority value is needed; it
+        keeps the order of the queue, so pop() and peek() work without it.
         """
-        items = []
-        updated_items = []
+        self._load()
+        self._reorder_pending = True
+        self._reorder_popped = 0
 
-        # Read all items from the file and store them in a list of (priority, item) tuples
-        with open(self.file_path, 'r') as file:
-            for line in file:
-                priority, item = line.strip().split(' ', 1)
-                items.append((int(priority), item))
+    def _apply_reorder(self):
+        """
+        Carry out a pending reorder_priorities().
+        """
+        if not self._reorder_pending:
+            return
 
-        # Sort the items by their existing priorities
-        items.sort(key=lambda x: x[0])
+        # Assign new consecutive priorities in the existing order, after the ones taken
+        # by the items popped since the reorder
+        self._renumber(self._reorder_popped + 1)
+        self._reorder_pending = False
 
-        # Assign new consecutive priorities starting from 1
-        new_priority = 1
-        for _, item in items:
-            updated_items.append((new_priority, item))
-            new_priority += 1
+    def _renumber(self, first=None):
+        """
+        Renumber the ids of the live items into (priority, id) order, so that the
+        file is rewritten sorted by priority as reorder_priorities() and
+        insert_and_shift_up() have always left it.
 
-        # Write the updated items back to the file
-        with open(self.file_path, 'w') as file:
-            for priority, item in updated_items:
-                file.write(f"{priority} {item}\n")
+        Parameters:
+        - first (int): If given, also assign consecutive priorities starting from it.
+        """
+        # A sorted list is already a valid heap. The sort is stable and the live items
+        # are in id order, so ties keep their order.
+        ordered = sorted(self._live.values(), key=itemgetter(0))
+        if first is None:
+            self._items = [(priority, new_id, item) for new_id, (priority, _, item) in enumerate(ordered)]
+        else:
+            self._items = [(first + new_id, new_id, item) for new_id, (_, _, item) in enumerate(ordered)]
+        self._live = {entry[1]: entry for entry in self._items}
+        self._index = None
+        self._seq = len(ordered)
+
+        # Every record changes, so the file is rewritten on the next flush
+        self._rewrite = True
+        self._changed = None
+        self._tail = None
 
     def print_queue(self):
         """
         Print the entire contents of the priority queue.
         """
-        with open(self.file_path, 'r') as file:
-            print(file.read())
+        self._apply_reorder()
+        self._load()
+
+        # The live items are in id order, which is the order they are stored in
+        print("".join(f"{priority} {item}\n" for priority, _, item in self._live.values()))
 
 
     def insert_and_shift_up(self, item, target_priority):
@@ -164,27 +801,25 @@ class PersistentPriorityQueue:
 
         Note: Feel free to use the reorder method after to make them consecutive
         """
-        items = []
-
-        # Read all items from the file into a list of (priority, item) tuples
-        with open(self.file_path, 'r') as file:
-            for line in file:
-                priority, existing_item = line.strip().split(' ', 1)
-                items.append((int(priority), existing_item))
+        item = str(item)
+        target_priority = int(target_priority)
+        self._apply_reorder()
+        self._load()
 
         # Increment the priorities of items that are >= target_priority
-        items = [(p + 1 if p >= target_priority else p, i) for p, i in items]
+        live = self._live
+        for item_id, (priority, _, existing_item) in live.items():
+            if priority >= target_priority:
+                live[item_id] = (priority + 1, item_id, existing_item)
 
         # Insert the new item
-        items.append((target_priority, item))
-
-        # Sort the updated items
-        items.sort(key=lambda x: x[0])
+        item_id = self._seq
+        self._seq += 1
+        live[item_id] = (target_priority, item_id, item)
 
-        # Write the updated items back to the file
-        with open(self.file_path, 'w') as file:
-            for priority, existing_item in items:
-                file.write(f"{priority} {existing_item}\n")
+        # Sort the updated items; this also rebuilds the heap from the live items
+        self._renumber()
+        self._maybe_compact()
 
 
 
@@ -209,25 +844,27 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-if args.push: # Example: --push "Task C" 3
-    item, priority = args.push
-    pq.push(item, int(priority))
-elif args.pop: # Example: --pop
-    item = pq.pop()
-    print(f"Popped item: {item}")
-elif args.peek: # Example: --peek
-    item = pq.peek()
-    print(f"Peeked item: {item}")
-elif args.is_empty: # Example: --is_empty
-    is_empty = pq.is_empty()
-    print(f"Queue is empty: {is_empty}")
-elif args.change_priority: # Example: --change_priority "Task A" 2
-    item, new_priority = args.change_priority
-    pq.change_priority(item, int(new_priority))
-elif args.reorder_priorities: # Example: --reorder_priorities
-    pq.reorder_priorities()
-elif args.print_queue: # Example: --print_queue
-    pq.print_queue()
-elif args.insert_and_shift_up: # Example: --insert_and_shift_up "Task D" 2
-    item, target_priority = args.insert_and_shift_up
-    pq.insert_and_shift_up(item, int(target_priority))
+    if args.push: # Example: --push "Task C" 3
+        item, priority = args.push
+        pq.push(item, int(priority))
+    elif args.pop: # Example: --pop
+        item = pq.pop()
+        print(f"Popped item: {item}")
+    elif args.peek: # Example: --peek
+        item = pq.peek()
+        print(f"Peeked item: {item}")
+    elif args.is_empty: # Example: --is_empty
+        is_empty = pq.is_empty()
+        print(f"Queue is empty: {is_empty}")
+    elif args.change_priority: # Example: --change_priority "Task A" 2
+        item, new_priority = args.change_priority
+        pq.change_priority(item, int(new_priority))
+    elif args.reorder_priorities: # Example: --reorder_priorities
+        pq.reorder_priorities()
+    elif args.print_queue: # Example: --print_queue
+        pq.print_queue()
+    elif args.insert_and_shift_up: # Example: --insert_and_shift_up "Task D" 2
+        item, target_priority = args.insert_and_shift_up
+        pq.insert_and_shift_up(item, int(target_priority))
+
+    pq.close()
@@ -0,0 +1,286 @@
+import errno
+import gc
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from main import PersistentPriorityQueue, _HEADER
+
+
+class PersistentPriorityQueueTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, "priority_queue.txt")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def write(self, data):
+        with open(self.path, "wb") as file:
+            file.write(data)
+
+    def read(self):
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def pop_all(self, pq):
+        items = []
+        while not pq.is_empty():
+            items.append(pq.pop())
+        return items
+
+    def printed(self, pq):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            pq.print_queue()
+        return out.getvalue()
+
+    def test_round_trip(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("a", 3)
+            pq.push("b", 1)
+            pq.push("c", 2)
+            pq.push("d", 5)
+            self.assertEqual(pq.pop(), "b")
+            pq.change_priority("c", 4)
+            pq.reorder_priorities()
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.printed(pq), "1 a\n2 c\n3 d\n\n")
+            self.assertEqual(self.pop_all(pq), ["a", "c", "d"])
+
+        self.assertEqual(self.read(), _HEADER)
+
+    def test_pops_during_deferred_reorder(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("c", 30)
+            pq.push("a", 10)
+            pq.push("b", 20)
+            pq.reorder_priorities()
+            # The popped item took priority 1
+            self.assertEqual(pq.pop(), "a")
+            self.assertEqual(pq.peek(), "b")
+            self.assertEqual(self.printed(pq), "2 b\n3 c\n\n")
+            pq.push("d", 0)
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.printed(pq), "2 b\n3 c\n0 d\n\n")
+            self.assertEqual(self.pop_all(pq), ["d", "b", "c"])
+
+    def test_legacy_file(self):
+        self.write(b"3 c\n1 a\n2 b\n")
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(pq.pop(), "a")
+            pq.push("d", 0)
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["d", "b", "c"])
+
+    def test_newer_format_version(self):
+        newer = b"# heapqbasic 2\n+ 1 a\n"
+        self.write(newer)
+        with PersistentPriorityQueue(self.path) as pq:
+            with self.assertRaises(ValueError):
+                pq.peek()
+
+        # Pushing without loading the queue checks the header too
+        pq = PersistentPriorityQueue(self.path)
+        pq.push("b", 2)
+        with self.assertRaises(ValueError):
+            pq.close()
+        self.assertEqual(self.read(), newer)
+
+    def test_compact_without_final_newline(self):
+        self.write(_HEADER + b"+ 1 a\n+ 2 b\n+ 3 c\n+ 4 d")
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(pq.pop(), "a")
+            self.assertEqual(pq.pop(), "b")
+            pq.push("e", 5)
+            pq.compact()
+
+        self.assertEqual(self.read(), _HEADER + b"+ 3 c\n+ 4 d\n+ 5 e\n")
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["c", "d", "e"])
+
+    def test_compact_copies_unchanged_records(self):
+        # Copied records keep their bytes, so the leading zeros show which were copied
+        self.write(_HEADER + b"+ 02 a\n+ 1 b\n3 c\n+ 04 d\n- 1\n= 3 5\n+ 06 e\n")
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.compact()
+
+        self.assertEqual(self.read(), _HEADER + b"+ 02 a\n+ 3 c\n+ 5 d\n+ 06 e\n")
+
+    def test_compact_without_sendfile(self):
+        self.write(_HEADER + b"+ 02 a\n+ 1 b\n- 1\n")
+        error = OSError(errno.EINVAL, "Invalid argument")
+        with mock.patch.object(os, "sendfile", side_effect=error, create=True):
+            with PersistentPriorityQueue(self.path) as pq:
+                pq.compact()
+
+        self.assertEqual(self.read(), _HEADER + b"+ 02 a\n")
+
+    def test_compacts_once_most_records_are_dead(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("a", 1)
+            pq.push("b", 2)
+            pq.push("c", 3)
+
+        pq = PersistentPriorityQueue(self.path)
+        pq.compact_min_dead = 1
+        self.assertEqual(pq.pop(), "a")
+        pq.flush()
+        self.assertEqual(self.read(), _HEADER + b"+ 1 a\n+ 2 b\n+ 3 c\n- 0\n")
+        self.assertEqual(pq.pop(), "b")
+        self.assertEqual(self.read(), _HEADER + b"+ 3 c\n")
+        pq.close()
+
+    def test_append_without_final_newline(self):
+        self.write(_HEADER + b"+ 1 a\n+ 2 b\n+ 4 d")
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(pq.pop(), "a")
+
+        self.assertEqual(self.read(), _HEADER + b"+ 1 a\n+ 2 b\n+ 4 d\n- 0\n")
+
+        # Also when pushing to a file which is not loaded
+        self.write(b"3 c")
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("a", 1)
+
+        self.assertEqual(self.read(), b"3 c\n+ 1 a\n")
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["a", "c"])
+
+    def test_ties_after_insert_and_shift_up(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("a", 5)
+            pq.push("b", 3)
+            pq.insert_and_shift_up("c", 10)
+            pq.change_priority("a", 1)
+            pq.change_priority("b", 1)
+            self.assertEqual(pq.peek(), "b")
+
+        # The file keeps the same order
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["b", "a", "c"])
+
+    def test_reload_after_another_writer(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("b", 2)
+            self.assertEqual(pq.peek(), "b")
+
+            with PersistentPriorityQueue(self.path) as other:
+                other.push("a", 1)
+
+            self.assertEqual(pq.peek(), "a")
+
+    def test_conflicting_writers(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("a", 1)
+            pq.push("b", 2)
+
+        first = PersistentPriorityQueue(self.path)
+        second = PersistentPriorityQueue(self.path)
+        self.assertEqual(first.pop(), "a")
+        self.assertEqual(second.pop(), "a")
+        first.close()
+        # The second pop refers to the file as it was before the first one
+        with self.assertRaises(RuntimeError):
+            second.close()
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["b"])
+
+    def test_duplicate_tombstone(self):
+        self.write(_HEADER + b"+ 1 a\n+ 2 b\n- 0\n- 0\n= 0 5\n")
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["b"])
+
+    def test_pop_truncates_tail_record(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("b", 2)
+            pq.push("a", 1)
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(pq.pop(), "a")
+            self.assertEqual(self.read(), _HEADER + b"+ 2 b\n")
+            # The pending record of the next push goes the same way
+            pq.push("c", 0)
+            self.assertEqual(pq.pop(), "c")
+
+        self.assertEqual(self.read(), _HEADER + b"+ 2 b\n")
+
+    def test_pop_keeps_tail_changed_by_another_writer(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push("b", 2)
+            pq.push("a", 1)
+
+        pq = PersistentPriorityQueue(self.path)
+        pq.reorder_priorities()
+        with PersistentPriorityQueue(self.path) as other:
+            other.push("z", 3)
+
+        # The tail record is no longer at the end, so it must not be truncated
+        self.assertEqual(pq.pop(), "a")
+        with self.assertRaises(RuntimeError):
+            pq.close()
+        self.assertEqual(self.read(), _HEADER + b"+ 2 b\n+ 1 a\n+ 3 z\n")
+
+    def test_write_buffer_size(self):
+        pq = PersistentPriorityQueue(self.path)
+        pq.write_buffer_size = 64
+        pq.push("a", 1)
+        self.assertFalse(os.path.exists(self.path))
+        for i in range(10):
+            pq.push("b", 2)
+        # Only the records beyond the last full buffer are pending
+        self.assertLess(pq._log_size, 64)
+        self.assertEqual(len(self.read()) + pq._log_size, len(_HEADER) + 11 * len(b"+ 1 a\n"))
+        pq.close()
+
+    def test_write_buffer_size_with_pending_rewrite(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.write_buffer_size = 64
+            pq.push("a", 1)
+            pq.insert_and_shift_up("b", 1)
+            for i in range(20):
+                pq.push("c", 3)
+                self.assertLess(pq._log_size, 64)
+            # The buffered pushes went out with the rewrite instead of piling up
+            self.assertTrue(self.read().startswith(_HEADER + b"+ 1 b\n+ 2 a\n+ 3 c\n"))
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["b", "a"] + 20 * ["c"])
+
+    def test_unclosed_queue_is_written(self):
+        pq = PersistentPriorityQueue(self.path)
+        pq.push("a", 1)
+        del pq
+        gc.collect()
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.pop_all(pq), ["a"])
+
+    def test_reads_do_not_create_the_file(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertTrue(pq.is_empty())
+            with self.assertRaises(IndexError):
+                pq.peek()
+            self.assertEqual(self.printed(pq), "\n")
+            pq.sync()
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_push_converts_item_and_priority(self):
+        with PersistentPriorityQueue(self.path) as pq:
+            pq.push(5, "1")
+            self.assertEqual(pq.peek(), "5")
+
+        with PersistentPriorityQueue(self.path) as pq:
+            self.assertEqual(self.printed(pq), "1 5\n\n")
+
+
+if __name__ == "__main__":
+    unittest.main()